@@ -4,6 +4,14 @@ import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 import statsmodels.api as sm
+import json
+import multiprocessing
+import os
+import zipfile
+import plotly.io as pio
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from plotly.offline import get_plotlyjs
 
 # --- 1. 页面配置 ---
 st.set_page_config(page_title="酒精笔销量深度看板", layout="wide")
@@ -11,46 +19,779 @@ st.title("📊 酒精笔市场趋势监测看板")
 st.markdown("---")
 
 # --- 2. 数据处理 ---
+
+# 必需字段：缺失时直接提示，不再进入后续分析
+required_columns = ['ASIN', 'month(month)', '笔头类型', '销量', '单只价格', '支数', '是否8+', '价格段']
+numeric_columns = ['价格', '销量', '销售额', '单只价格', '支数']
+
+# 数据质量问题位掩码：每行一个整数 (数据问题 列)，按位记录命中的检查项
+issue_flags = {
+    '字段类型异常': 1,    # 数值列存在无法解析的值 (如 "--")
+    '单只价格无效': 2,    # 单只价格缺失或 ≤ 0
+    'ASIN月份重复': 4,    # 同一 ASIN 同一月份出现多行
+    '价量异常': 8,        # 销售额 相对 单只价格 × 支数 × 销量 的偏差在同类产品中离群
+    '序列缺月': 16,       # 该 ASIN 在上一条记录与本条之间存在缺失月份
+    '月份无效': 32,       # month(month) 不是合法的 YYYYMM
+    '重复剔除': 64,       # ASIN-月份重复组中首行以外的行，所有聚合均剔除，避免重复计数
+}
+# 所有聚合统一剔除的问题：重复记录只保留首行
+duplicate_issue_mask = issue_flags['重复剔除']
+# 单只定价相关分析需要剔除的问题（单只价格无法解析时同样记为无效）
+price_issue_mask = issue_flags['单只价格无效']
+# 战略测算需要剔除的问题：价格无效 + 价量不一致 + 月份无效（需按年份切分）+ 重复行
+strategy_issue_mask = price_issue_mask | issue_flags['价量异常'] | issue_flags['月份无效'] | duplicate_issue_mask
+
+def validate_data(df, z_threshold=3.5, mad_floor=0.01):
+    """向量化数据质量检查，为每行生成 数据问题 位掩码（只标记、不删除）"""
+    issues = np.zeros(len(df), dtype=np.int64)
+
+    # 1. 字段类型：数值列统一转为数值，原本有值但无法解析的记为类型异常
+    for col in [c for c in numeric_columns if c in df.columns]:
+        parsed = pd.to_numeric(df[col], errors='coerce')
+        issues |= np.where(parsed.isna() & df[col].notna(), issue_flags['字段类型异常'], 0)
+        df[col] = parsed
+
+    # 2. 单只价格缺失或 ≤ 0
+    issues |= np.where(~(df['单只价格'] > 0), issue_flags['单只价格无效'], 0)
+
+    # 3. ASIN-月份重复：整组标记，首行以外的行另记剔除位
+    issues |= np.where(df.duplicated(['ASIN', 'month(month)'], keep=False), issue_flags['ASIN月份重复'], 0)
+    issues |= np.where(df.duplicated(['ASIN', 'month(month)'], keep='first'), issue_flags['重复剔除'], 0)
+
+    # 4. 价量组合异常：残差 log(销售额 / (单只价格 × 支数 × 销量)) 在 是否8+ × 笔头类型 分段内
+    #    按 中位数 / MAD 计算稳健 z 分数，|z| > z_threshold 记为异常
+    #    销售额多为三者精确相乘，MAD 接近 0，故设下限 mad_floor，避免把浮点舍入误差判为异常
+    #    一侧为 0 另一侧为正时残差为 ±inf，直接记为异常
+    expected = df['单只价格'] * df['支数'] * df['销量']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        resid = np.log(df['销售额'] / expected)
+    finite_resid = resid.where(np.isfinite(resid))
+    segments = [df['是否8+'], df['笔头类型']]
+    seg_median = finite_resid.groupby(segments, dropna=False).transform('median')
+    seg_mad = (finite_resid - seg_median).abs().groupby(segments, dropna=False).transform('median')
+    robust_z = 0.6745 * (resid - seg_median) / seg_mad.clip(lower=mad_floor)
+    mismatch = (robust_z.abs() > z_threshold) | np.isinf(resid)
+    issues |= np.where(mismatch, issue_flags['价量异常'], 0)
+
+    # 5. 月份：必须是 6 位 YYYYMM 且月份在 1-12
+    month_val = pd.to_numeric(df['month(month)'].where(df['month(month)'].str.fullmatch(r'\d{6}')), errors='coerce')
+    valid_month = month_val.notna() & (month_val % 100).between(1, 12)
+    issues |= np.where(~valid_month, issue_flags['月份无效'], 0)
+
+    # 6. 序列缺月：只对月份合法的行按 ASIN 排序，相邻两条记录的月份序号相差 > 1
+    pos = np.flatnonzero(valid_month.to_numpy())
+    month_num = (month_val // 100 * 12 + month_val % 100).to_numpy()[pos]
+    asin_keys = df['ASIN'].astype(str).to_numpy()[pos]
+    sort_idx = np.lexsort((month_num, asin_keys))
+    order = pos[sort_idx]
+    gap = pd.Series(month_num[sort_idx]).groupby(asin_keys[sort_idx]).diff().to_numpy() - 1
+    gap_flag = np.zeros(len(df), dtype=np.int64)
+    gap_flag[order] = np.where(gap > 0, issue_flags['序列缺月'], 0)
+    issues |= gap_flag
+
+    df['数据问题'] = issues
+    df['缺失月数'] = 0
+    df.iloc[order, df.columns.get_loc('缺失月数')] = np.nan_to_num(np.clip(gap, 0, None)).astype(int)
+    return df
+
 @st.cache_data
 def load_data():
     file_path = "酒精笔销量数据.xlsx" 
     try:
         df = pd.read_excel(file_path, engine='openpyxl')
-        df.columns = [c.strip() for c in df.columns] 
-        
-        # --- 1. 强制转换月份为字符串并去除空格 (防止排序报错) ---
-        df['month(month)'] = df['month(month)'].astype(str).str.strip()
-        
-        # --- 2. 只有统一为字符串后，排序才是绝对安全的 ---
-        df = df.sort_values('month(month)')
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        st.error(f"数据加载出错: {e}")
+        return pd.DataFrame()
+    df.columns = [c.strip() for c in df.columns] 
 
-        # --- 3. 单只价格深度清洗 ---
-        df['单只价格'] = pd.to_numeric(df['单只价格'], errors='coerce')
-        df = df[df['单只价格'] > 0].copy() 
-        
-        # 价格区间定义 (保持你原有的逻辑)
-        bins = [0, 0.25, 0.5, 1.0, 2.0, 4.0, 6.0, float('inf')]
-        labels = [
-            '1. 超低价走量款 (≤0.25)', '2. 大众平价款 (0.25-0.5]', 
-            '3. 标准办公款 (0.5-1.0]', '4. 品质进阶款 (1.0-2.0]', 
-            '5. 中端功能款 (2.0-4.0]', '6. 中高端款 (4.0-6.0]', 
-            '7. 高端/奢侈款 (>6.0)'
-        ]
-        df['单只价格区间'] = pd.cut(df['单只价格'], bins=bins, labels=labels)
+    # --- 0. 字段结构检查 ---
+    missing_cols = [c for c in required_columns if c not in df.columns]
+    if missing_cols:
+        st.error(f"数据缺少必要字段: {', '.join(missing_cols)}，请检查 Excel 表头。")
+        return pd.DataFrame()
+    
+    # --- 1. 强制转换月份为字符串并去除空格 (防止排序报错) ---
+    df['month(month)'] = df['month(month)'].astype(str).str.strip()
+    
+    # --- 2. 只有统一为字符串后，排序才是绝对安全的 ---
+    df = df.sort_values('month(month)')
+
+    # 时间轴与填充
+    df['时间轴'] = df['month(month)'].apply(lambda x: f"{x[:4]}-{x[4:]}")
+    df['是否8+'] = df['是否8+'].fillna('否')
+    
+    if '目标分类' in df.columns:
+        df = df[df['目标分类'] == '酒精笔']
 
-        # 时间轴与填充
-        df['时间轴'] = df['month(month)'].apply(lambda x: f"{x[:4]}-{x[4:]}")
-        df['是否8+'] = df['是否8+'].fillna('否')
+    # --- 3. 数据质量检查：数值清洗 + 问题标记，价格异常行保留并由下游按标记剔除 ---
+    df = validate_data(df.copy())
+    
+    # 价格区间定义 (保持你原有的逻辑)
+    bins = [0, 0.25, 0.5, 1.0, 2.0, 4.0, 6.0, float('inf')]
+    labels = [
+        '1. 超低价走量款 (≤0.25)', '2. 大众平价款 (0.25-0.5]', 
+        '3. 标准办公款 (0.5-1.0]', '4. 品质进阶款 (1.0-2.0]', 
+        '5. 中端功能款 (2.0-4.0]', '6. 中高端款 (4.0-6.0]', 
+        '7. 高端/奢侈款 (>6.0)'
+    ]
+    df['单只价格区间'] = pd.cut(df['单只价格'], bins=bins, labels=labels)
         
-        if '目标分类' in df.columns:
-            df = df[df['目标分类'] == '酒精笔']
-            
-        return df
-    except Exception as e:
-        st.error(f"数据加载出错: {e}")
-        return pd.DataFrame()
+    return df
+
+def build_asin_index(data):
+    """按 ASIN + 月份排序的行存储，每个 ASIN 对应一段连续行区间 [起始偏移, 结束偏移)"""
+    store = data.sort_values(['ASIN', 'month(month)'], kind='stable').reset_index(drop=True)
+    asins, starts = np.unique(store['ASIN'].to_numpy(dtype=str), return_index=True)
+    ends = np.append(starts[1:], len(store))
+    return {'store': store, 'asins': asins, 'starts': starts, 'ends': ends}
+
+@st.cache_resource
+def load_asin_index():
+    """加载时构建一次 ASIN 索引；cache_resource 直接复用同一对象，查询时不再复制或哈希整表"""
+    return build_asin_index(load_data())
+
+def lookup_asin(index, asin):
+    """二分定位 ASIN 后按偏移切片，开销只与该 ASIN 的行数有关"""
+    i = np.searchsorted(index['asins'], asin)
+    if i == len(index['asins']) or index['asins'][i] != asin:
+        return index['store'].iloc[0:0]
+    return index['store'].iloc[index['starts'][i]:index['ends'][i]]
+
+def search_asins(index, prefix, limit=200):
+    """前缀搜索：在有序 ASIN 列表上二分出前缀区间，返回 (前 limit 个匹配项, 实际匹配总数)"""
+    asins = index['asins']
+    lo = np.searchsorted(asins, prefix, side='left')
+    hi = np.searchsorted(asins, prefix + '\uffff', side='right')
+    return asins[lo:min(hi, lo + limit)].tolist(), int(hi - lo)
+
+def pick_drill_asin(source, asin):
+    """图表 / 榜单的选中项变化时才切换下钻目标，避免残留的选中状态覆盖手动选择"""
+    if asin and st.session_state.get(f'drill_src_{source}') != asin:
+        st.session_state['drill_asin'] = asin
+    st.session_state[f'drill_src_{source}'] = asin
+
+@st.cache_data
+def build_leaderboard(data, top_n=15):
+    """按 季度 × 是否8+ 分段计算 Top-N 榜单，同一遍历内产出集中度 (CR5/CR10/HHI) 与进出榜变动"""
+    # 1. 剔除重复记录后聚合到 (分段, 季度, ASIN) 粒度，后续计算与原始行数无关
+    data = data[(data['数据问题'] & duplicate_issue_mask) == 0]
+    asin_q = data.groupby(['是否8+', '季度', 'ASIN'])['销量'].sum().reset_index()
+    all_q = asin_q.groupby(['季度', 'ASIN'])['销量'].sum().reset_index()
+    all_q['是否8+'] = '全部'
+    asin_q = pd.concat([all_q, asin_q], ignore_index=True)
+
+    rank_rows, conc_rows = [], []
+    prev_top = {}  # 每个分段上一季度的榜单，用于计算进出榜
+    for (seg, quarter), grp in asin_q.groupby(['是否8+', '季度'], sort=True):
+        sales = grp['销量'].to_numpy(dtype=float)
+        asins = grp['ASIN'].to_numpy()
+        total = sales.sum()
+
+        # 2. 分区选择：argpartition 为 O(n)，只对选出的前 k 个排序
+        k = min(max(top_n, 10), len(sales))
+        idx = np.argpartition(-sales, k - 1)[:k]
+        idx = idx[np.argsort(-sales[idx], kind='stable')]
+        share = sales[idx] / total if total > 0 else np.zeros(k)
+
+        top_idx = idx[:top_n]
+        for rank, i in enumerate(top_idx, start=1):
+            rank_rows.append({
+                '是否8+': seg, '季度': quarter, '排名': rank, 'ASIN': asins[i],
+                '销量': sales[i], '份额': share[rank - 1]
+            })
+
+        # 3. 进出榜：与同分段上一季度的 Top-N 对比
+        curr_set = set(asins[top_idx])
+        last_set = prev_top.get(seg)
+        entries = sorted(curr_set - last_set) if last_set is not None else []
+        exits = sorted(last_set - curr_set) if last_set is not None else []
+        prev_top[seg] = curr_set
+
+        conc_rows.append({
+            '是否8+': seg, '季度': quarter,
+            '总销量': total,
+            '头部销量': sales[top_idx].sum(),
+            'CR5': share[:5].sum(),
+            'CR10': share[:10].sum(),
+            'HHI': ((sales / total) ** 2).sum() * 10000 if total > 0 else 0,
+            '新进榜数': len(entries), '跌出榜数': len(exits),
+            '新进榜ASIN': ', '.join(entries), '跌出榜ASIN': ', '.join(exits)
+        })
+
+    return pd.DataFrame(rank_rows), pd.DataFrame(conc_rows)
+
+# --- 2.1 共享数据表：看板与报告导出共用同一份聚合结果 ---
+
+# 价格段排序（确保 0-4.99 在最下面，>=70 在最上面）
+price_order = ['0-4.99', '5-9.99', '10-14.99', '15-19.99', '20-24.99', '25-29.99', '30-34.99', '35-39.99', '40-69.99', '>=70']
+
+# 单只定价标签顺序，确保图表堆叠逻辑从低价到高价
+biz_price_order = [
+    '1. 超低价走量款 (≤0.25)',
+    '2. 大众平价款 (0.25-0.5]',
+    '3. 标准办公款 (0.5-1.0]',
+    '4. 品质进阶款 (1.0-2.0]',
+    '5. 中端功能款 (2.0-4.0]',
+    '6. 中高端款 (4.0-6.0]',
+    '7. 高端/奢侈款 (>6.0)'
+]
+
+# ASIN 矩阵：固定 12 个月区间与预定义的新品列表
+target_12_months = [
+    '202412', '202501', '202502', '202503', '202504', '202505',
+    '202506', '202507', '202508', '202509', '202510', '202511'
+]
+new_asin_list = [
+    "B0FL78FF2F", "B0DP9BMKJR", "B0FB8LM5ZR", "B0FL2GLMPZ", "B0FDKM2Q3V",
+    "B0DP9FDTT3", "B0F4X5NMCF", "B0F3JFHGCP", "B0FDG8XJPS", "B0FGHQCR1C",
+    "B0FH4PYS7Q", "B0FH9MB9LD", "B0FJQM9LVB", "B0FJQXT63G"]
+
+def build_share_table(data, col):
+    """按月和指定维度聚合销量，并计算每月占比（归一化）"""
+    share_data = data.groupby(['时间轴', col], observed=False)['销量'].sum().reset_index()
+    monthly_total = share_data.groupby('时间轴')['销量'].transform('sum')
+    share_data['占比'] = share_data['销量'] / monthly_total.replace(0, np.nan)
+    return share_data
+
+def build_spec_table(data):
+    """销量前 10 的规格及其月度份额"""
+    spec_total = data.groupby('支数')['销量'].sum().sort_values(ascending=False).reset_index()
+    top_10_specs = spec_total.head(10)['支数'].tolist()
+    spec_data_all = build_share_table(data[data['支数'].isin(top_10_specs)], '支数')
+    return top_10_specs, spec_data_all
+
+@st.cache_data
+def build_strategy_table(data, age):
+    """规格 x 笔尖 的今年 vs 去年月均增长、份额与增长贡献率"""
+    # 剔除价格无效与价量异常行（复用加载时的数据质量标记），并提取年份
+    data = data[(data['数据问题'] & strategy_issue_mask) == 0]
+    data = data.assign(year_int=data['month(month)'].astype(str).str[:4].astype(int))
+
+    # 1. 自动定义“今年”和“去年”
+    latest_year = data['year_int'].max()
+    prev_year = latest_year - 1
+
+    # 2. 人群筛选过滤
+    if age != "全部":
+        base_calc_df = data[data['是否8+'] == age]
+    else:
+        base_calc_df = data
+
+    # 3. 分组聚合：增加对“月份数”的统计，用于计算月均值
+    # 今年数据：统计总销量和今年该产品卖了几个月
+    current_growth = base_calc_df[base_calc_df['year_int'] == latest_year].groupby(['支数', '笔头类型']).agg({
+        '销量': 'sum',
+        '销售额': 'sum',
+        'month(month)': 'nunique'  # 统计今年活跃了几个月
+    }).reset_index().rename(columns={'month(month)': '今年活跃月数'})
+
+    # 去年数据：统计总销量和去年该产品卖了几个月
+    prev_growth = base_calc_df[base_calc_df['year_int'] == prev_year].groupby(['支数', '笔头类型']).agg({
+        '销量': 'sum',
+        'month(month)': 'nunique'  # 统计去年活跃了几个月
+    }).reset_index().rename(columns={'销量': '去年销量', 'month(month)': '去年活跃月数'})
+
+    # 4. 合并计算
+    strat_df = pd.merge(current_growth, prev_growth, on=['支数', '笔头类型'], how='left').fillna(0)
+
+    # --- 核心逻辑切换：月均销量 ---
+    # 计算月均值（防止分母为0）
+    strat_df['今年月均'] = strat_df['销量'] / strat_df['今年活跃月数']
+    strat_df['去年月均'] = strat_df['去年销量'] / strat_df['去年活跃月数'].replace(0, np.nan)
+
+    # A. 同比增长率：现在是基于“月均效率”的增长
+    strat_df['同比增长率'] = (strat_df['今年月均'] - strat_df['去年月均']) / strat_df['去年月均']
+
+    # B. 市场份额：依然基于今年总销量，反映实际市场地位
+    strat_df['市场份额'] = strat_df['销量'] / strat_df['销量'].sum()
+
+    # C. 增长贡献率：基于总增量，反映对大盘贡献的物理支柱作用
+    total_delta = strat_df['销量'].sum() - strat_df['去年销量'].sum()
+    strat_df['增长贡献率'] = (strat_df['销量'] - strat_df['去年销量']) / (total_delta if total_delta != 0 else 1)
+
+    # --- 战略过滤 ---
+    # 问题行已由数据质量标记剔除；这里只过滤去年无基数（增长率无定义）的组合，
+    # 以及今年合计销量 ≤ 100 的组合——后者是气泡图的展示门槛（聚合层面），不属于行级数据质量
+    plot_df = strat_df[
+        (strat_df['销量'] > 100) &
+        np.isfinite(strat_df['同比增长率'])
+    ].copy()
+    return plot_df, latest_year, prev_year
+
+def build_triple_table(biz_df):
+    """支数(X), 单只单价(Y), 笔头类型(分栏), 价格段(颜色) 的交叉聚合"""
+    triple_data = biz_df.groupby(['支数', '笔头类型', '价格段'], observed=False).agg({
+        '销量': 'sum',
+        '单只价格': 'mean'
+    }).reset_index()
+    return triple_data[triple_data['销量'] > 100]
+
+@st.cache_data
+def build_asin_matrix(data, age):
+    """固定 12 个月窗口内逐 ASIN 计算月均销量、RLM 趋势得分与产品分类"""
+    id_col = 'ASIN'
+    month_col = 'month(month)'
+
+    matrix_base_df = data[data[month_col].astype(str).isin(target_12_months) & ((data['数据问题'] & duplicate_issue_mask) == 0)]
+
+    # 同步侧边栏人群筛选
+    if age != "全部":
+        matrix_base_df = matrix_base_df[matrix_base_df['是否8+'] == age]
+
+    asin_stats = []
+    # 第一步：遍历计算每个 ASIN 的基础统计值
+    for asin, group in matrix_base_df.groupby(id_col):
+        # 核心指标：该 ASIN 在这 12 个月里实际出现了几个月？
+        m_sales_series = group.groupby(month_col)['销量'].sum().sort_index()
+        active_months = len(m_sales_series)
+
+        # Y 轴：月平均销量
+        avg_sales = m_sales_series.mean()
+
+        # X 轴：月度趋势得分 (RLM 回归)
+        m_sales = m_sales_series.values
+        if active_months > 1:
+            x = np.arange(len(m_sales))
+            x_with_const = sm.add_constant(x)
+            try:
+                model = sm.RLM(m_sales, x_with_const).fit()
+                trend_score = model.params[1]
+            except:
+                trend_score = 0
+        else:
+            trend_score = 0
+
+        asin_stats.append({
+            'ASIN': asin,
+            '销售趋势得分': trend_score,
+            '月均销量': avg_sales,
+            '活跃月份数': active_months  # 【新增】记录生存时长
+        })
+
+    plot_df = pd.DataFrame(asin_stats)
+    if plot_df.empty:
+        return plot_df
+
+    # --- 第二步：分类边界定义 ---
+    x_p25 = plot_df['销售趋势得分'].quantile(0.25)
+    x_p75 = plot_df['销售趋势得分'].quantile(0.75)
+
+    def classify_asin(row):
+        # 优先判定为手动指定的新品
+        if row['ASIN'] in new_asin_list:
+            return '新品 (90天)'
+
+        # 【优化点】：只有销售时长 >= 4 个月的产品，才有资格评选“稳定产品”
+        # 活跃月份太短的产品（即便得分平稳）统一划入“动态/待观察”
+        if row['活跃月份数'] >= 4:
+            if x_p25 <= row['销售趋势得分'] <= x_p75:
+                return '稳定产品'
+
+        return '动态产品'
+
+    plot_df['产品类型'] = plot_df.apply(classify_asin, axis=1)
+    return plot_df
+
+def build_struct_table(conc_df, age, years, top_n):
+    """从榜单结果切出当前分段的季度集中度，并拆分为 头部 vs 长尾 的销量结构"""
+    top_label = f'Top{top_n}头部'
+    seg_conc = conc_df[
+        (conc_df['是否8+'] == age) &
+        (conc_df['季度'].str[:4].isin(years))
+    ].sort_values('季度')
+
+    # 头部 vs 长尾的季度销量结构，直接取自榜单聚合结果
+    quarter_stats = pd.concat([
+        seg_conc[['季度', '头部销量']].rename(columns={'头部销量': '销量'}).assign(产品类型=top_label),
+        seg_conc.assign(销量=seg_conc['总销量'] - seg_conc['头部销量'])[['季度', '销量']].assign(产品类型='其他长尾产品')
+    ], ignore_index=True)
+
+    # 计算每个季度的贡献占比
+    quarter_total = quarter_stats.groupby('季度')['销量'].transform('sum')
+    quarter_stats['贡献占比'] = quarter_stats['销量'] / quarter_total.replace(0, np.nan)
+    return seg_conc, quarter_stats
+
+# --- 2.2 图表构建函数：只接收聚合好的数据表，不再触碰原始行 ---
+
+def build_share_area_fig(share_data, col, order, label, height=450):
+    """市场份额推移堆积面积图 (笔头类型 / 价格段 / 单只定价区间 通用)"""
+    fig = go.Figure()
+    # 只保留数据中存在的类别，并按给定顺序堆叠
+    existing = [v for v in order if v in share_data[col].unique()]
+
+    for value in existing:
+        sub_df = share_data[share_data[col] == value]
+        fig.add_trace(go.Scatter(
+            x=sub_df['时间轴'],
+            y=sub_df['占比'],
+            name=value,
+            stackgroup='one',  # 开启堆积模式
+            mode='lines',
+            fill='tonexty',
+            hovertemplate=f"{label}: {value}<br>份额: %{{y:.1%}}<extra></extra>"
+        ))
+
+    fig.update_layout(
+        xaxis_title="时间轴",
+        yaxis_title="市场份额占比",
+        yaxis_tickformat='.0%',  # 纵坐标显示百分比
+        hovermode="x unified",    # 悬浮时显示该时间点所有数据
+        height=height,
+        template="plotly_white",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+def build_spec_share_fig(spec_data_all):
+    """核心规格市场份额推移（固定显示 Top 10）"""
+    fig_spec_area = go.Figure()
+
+    for cat in sorted(spec_data_all['支数'].unique()):
+        df_sub = spec_data_all[spec_data_all['支数'] == cat]
+        fig_spec_area.add_trace(go.Scatter(
+            x=df_sub['时间轴'],
+            y=df_sub['占比'],
+            name=f"{cat}支",
+            stackgroup='one',
+            fill='tonexty',
+            hoveron='points',
+            customdata=df_sub['销量'],
+            # 重点：加入 时间: %{x}
+            hovertemplate=(
+                "时间: %{x}<br>"
+                "规格: %{fullData.name}<br>"
+                "占比: %{y:.1%}<br>"
+                "销量: %{customdata:,.0f}"
+                "<extra></extra>"
+            )
+        ))
+
+    fig_spec_area.update_layout(hovermode="closest", yaxis_tickformat='.0%', height=500)
+    return fig_spec_area
+
+def build_biz_dist_fig(biz_dist):
+    """柱状图：展示各单只定价区间总销量"""
+    return px.bar(
+        biz_dist,
+        x='单只价格区间', y='销量',
+        color='单只价格区间',
+        text_auto='.2s',
+        title="哪个定价带最能出单？",
+        category_orders={"单只价格区间": biz_price_order}
+    )
+
+def build_strategy_fig(plot_df, latest_year, prev_year):
+    """战略定位气泡图：规格 x 笔尖"""
+    fig_strat = px.scatter(
+        plot_df,
+        x='市场份额',
+        y='同比增长率',
+        size='销量',
+        color='增长贡献率',
+        facet_col='笔头类型',
+        hover_name='支数',
+        # 悬浮框增加月均信息
+        hover_data={'今年活跃月数': True, '今年月均': ':.1f', '去年月均': ':.1f'},
+        color_continuous_scale='RdBu',
+        color_continuous_midpoint=0,
+        range_color=[-0.8, 0.8], # 饱和点设在80%贡献率
+        title=f"战略定位：{latest_year} vs {prev_year} (月均增长逻辑)",
+        labels={'市场份额': '市场份额 (重要性)', '同比增长率': '月均销量增长 (爆发力)'},
+        height=600,
+        template="plotly_white"
+    )
+
+    # 视觉增强
+    fig_strat.update_traces(marker=dict(line=dict(width=1, color='DarkSlateGrey'), opacity=0.85))
+    fig_strat.add_hline(y=0, line_dash="dash", line_color="black", opacity=0.3)
+    fig_strat.update_layout(coloraxis_colorbar=dict(title="贡献率(深蓝优)", tickformat=".0%"))
+    return fig_strat
+
+def build_triple_fig(triple_data):
+    """规格 x 定价 x 笔尖 三维交叉散点图"""
+    fig_triple = px.scatter(
+        triple_data,
+        x='支数',
+        y='单只价格',
+        size='销量',
+        color='价格段',
+        facet_col='笔头类型',
+        title="第三层：定义产品 (寻找高销量、高溢价的配置组合)",
+        labels={'支数': '包装规格(支)', '单只价格': '平均单支售价(元)'},
+        height=600,
+        size_max=40,
+        template="plotly_white",
+        category_orders={"价格段": price_order}
+    )
+
+    fig_triple.update_layout(hovermode="closest")
+    return fig_triple
+
+def build_matrix_fig(plot_df):
+    """ASIN 产品矩阵散点图"""
+    x_p25 = plot_df['销售趋势得分'].quantile(0.25)
+    x_p75 = plot_df['销售趋势得分'].quantile(0.75)
+    x_median = plot_df['销售趋势得分'].median()
+    y_median = plot_df['月均销量'].median()
+
+    fig_matrix = go.Figure()
+
+    color_map = {'动态产品': '#8c8cb4', '稳定产品': '#f2c977', '新品 (90天)': '#d65a5a'}
+    symbol_map = {'动态产品': 'circle', '稳定产品': 'square', '新品 (90天)': 'triangle-up'}
+
+    for t in ['稳定产品', '动态产品', '新品 (90天)']:
+        curr_df = plot_df[plot_df['产品类型'] == t]
+        if not curr_df.empty:
+            fig_matrix.add_trace(go.Scatter(
+                x=curr_df['销售趋势得分'],
+                y=curr_df['月均销量'],
+                mode='markers',
+                name=t,
+                marker=dict(color=color_map[t], symbol=symbol_map[t], size=10, opacity=0.8),
+                text=curr_df['ASIN'],
+                customdata=curr_df[['活跃月份数', 'ASIN']], # 传入活跃月份与 ASIN (供下钻)
+                hovertemplate=(
+                    "<b>ASIN: %{text}</b><br>" +
+                    "活跃月份数: %{customdata[0]}月<br>" +
+                    "月度趋势得分: %{x:.2f}<br>" +
+                    "月均销量: %{y:.0f}<br>" +
+                    "分类: " + t + "<extra></extra>"
+                )
+            ))
+
+    # 视觉辅助线
+    fig_matrix.add_vline(x=x_p25, line_dash="dash", line_color="red", line_width=0.8,
+                         annotation_text=f"P25: {x_p25:.2f}", annotation_position="top left")
+    fig_matrix.add_vline(x=x_median, line_color="red", line_width=1.5,
+                         annotation_text=f"<b>中位数: {x_median:.2f}</b>", annotation_position="top")
+    fig_matrix.add_vline(x=x_p75, line_dash="dash", line_color="red", line_width=0.8,
+                         annotation_text=f"P75: {x_p75:.2f}", annotation_position="top right")
+    fig_matrix.add_hline(y=y_median, line_color="#4a90e2", line_width=1.5,
+                         annotation_text=f"销量中位数: {y_median:,.0f}", annotation_position="right")
+
+    # 布局设置
+    fig_matrix.update_layout(
+        template="plotly_white",
+        title=f"产品矩阵分析 (固定周期: 202412 - 202511 | 稳定产品门槛: 活跃≥4个月)",
+        xaxis_title="销售趋势得分 (月度增长斜率)",
+        yaxis_title="月度平均销量",
+        height=700,
+        margin=dict(r=120, t=100),
+        xaxis=dict(range=[plot_df['销售趋势得分'].min()*1.2 - 1, plot_df['销售趋势得分'].max()*1.2 + 1]),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig_matrix
+
+def build_struct_fig(quarter_stats, top_n):
+    """各季度 Top-N vs 长尾 结构堆积柱状图"""
+    top_label = f'Top{top_n}头部'
+    return px.bar(
+        quarter_stats,
+        x='季度',
+        y='销量',
+        color='产品类型',
+        title=f"各季度市场结构演变 (Top{top_n} vs 其他)",
+        color_discrete_map={top_label: '#1f77b4', '其他长尾产品': '#e5ecf6'},
+        category_orders={'季度': sorted(quarter_stats['季度'].unique())},
+        barmode='relative',
+        text_auto='.2s'
+    )
+
+def build_ratio_fig(top_trend, top_n):
+    """Top-N 销量贡献率折线图"""
+    fig_ratio = px.line(
+        top_trend,
+        x='季度',
+        y='贡献占比',
+        markers=True,
+        title=f"Top{top_n} 市场销量贡献率走势 (%)",
+        text=top_trend['贡献占比'].apply(lambda x: f"{x:.1%}")
+    )
+    fig_ratio.update_traces(textposition="top center", line_color='#d65a5a', line_width=3)
+    fig_ratio.update_layout(yaxis_tickformat='.0%', yaxis_range=[0, 1])
+    return fig_ratio
+
+def build_conc_fig(seg_conc):
+    """市场集中度：CR5 / CR10 (左轴) 与 HHI (右轴)"""
+    fig_conc = go.Figure()
+    for cr, color in [('CR5', '#1f77b4'), ('CR10', '#d65a5a')]:
+        fig_conc.add_trace(go.Scatter(
+            x=seg_conc['季度'], y=seg_conc[cr], name=cr, mode='lines+markers',
+            line=dict(color=color, width=3),
+            hovertemplate=f"{cr}: %{{y:.1%}}<extra></extra>"
+        ))
+    fig_conc.add_trace(go.Bar(
+        x=seg_conc['季度'], y=seg_conc['HHI'], name='HHI', yaxis='y2',
+        marker_color='#e5ecf6', opacity=0.6,
+        hovertemplate="HHI: %{y:,.0f}<extra></extra>"
+    ))
+    fig_conc.update_layout(
+        yaxis=dict(title="集中度 CRn", tickformat='.0%', range=[0, 1]),
+        yaxis2=dict(title="HHI", overlaying='y', side='right', showgrid=False),
+        hovermode="x unified",
+        height=450,
+        template="plotly_white",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig_conc
+
+# --- 2.3 静态报告导出：数据表按筛选条件只算一次，图表在工作进程中并行构建 ---
+
+# 报告图表构建函数：定义在模块层，工作进程可按名称找到（lambda 无法跨进程传递）
+def report_tip_share(t):
+    return build_share_area_fig(t['tip_share'], '笔头类型', sorted(t['tip_share']['笔头类型'].unique()), '笔头')
+
+def report_spec_share(t):
+    return build_spec_share_fig(t['spec_share'])
+
+def report_price_share(t):
+    return build_share_area_fig(t['price_share'], '价格段', price_order, '价格段', height=500)
+
+def report_biz_dist(t):
+    return build_biz_dist_fig(t['biz_dist'])
+
+def report_biz_share(t):
+    return build_share_area_fig(t['biz_share'], '单只价格区间', biz_price_order, '区间')
+
+def report_strategy(t):
+    return build_strategy_fig(*t['strategy'])
+
+def report_triple(t):
+    return build_triple_fig(t['triple'])
+
+def report_asin_matrix(t):
+    return build_matrix_fig(t['asin_matrix'])
+
+def report_top_struct(t):
+    return build_struct_fig(t['quarter_stats'], t['top_n'])
+
+def report_top_ratio(t):
+    return build_ratio_fig(t['top_trend'], t['top_n'])
+
+def report_concentration(t):
+    return build_conc_fig(t['seg_conc'])
+
+# (键, 报告标题, 所需数据表, 构建函数)
+report_figures = [
+    ('tip_share', '笔头类型市场份额推移', 'tip_share', report_tip_share),
+    ('spec_share', '核心规格市场份额推移', 'spec_share', report_spec_share),
+    ('price_share', '价格段市场份额演变', 'price_share', report_price_share),
+    ('biz_dist', '单只定价区间销量对比', 'biz_dist', report_biz_dist),
+    ('biz_share', '单只价格区间份额演变', 'biz_share', report_biz_share),
+    ('strategy', '战略定位：细分蓝海机会识别', 'strategy', report_strategy),
+    ('triple', '规格 x 定价 x 笔尖 交叉博弈', 'triple', report_triple),
+    ('asin_matrix', 'ASIN 矩阵：爆款潜力挖掘', 'asin_matrix', report_asin_matrix),
+    ('top_struct', 'Top-N 季度市场结构演变', 'quarter_stats', report_top_struct),
+    ('top_ratio', 'Top-N 市场销量贡献率走势', 'quarter_stats', report_top_ratio),
+    ('concentration', '市场集中度推移 (CR5 / CR10 / HHI)', 'seg_conc', report_concentration),
+]
+
+def build_report_tables(data, years, age, top_n=15):
+    """按一组筛选条件一次性计算所有图表共用的数据表"""
+    mask = data['month(month)'].str[:4].isin(years) & ((data['数据问题'] & duplicate_issue_mask) == 0)
+    if age != "全部":
+        mask &= (data['是否8+'] == age)
+    filtered = data[mask]
+    biz = filtered[(filtered['数据问题'] & price_issue_mask) == 0]
+
+    tables = {
+        'top_n': top_n,
+        'tip_share': build_share_table(filtered, '笔头类型'),
+        'spec_share': build_spec_table(filtered)[1],
+        'price_share': build_share_table(filtered, '价格段'),
+        'biz_dist': biz.groupby('单只价格区间', observed=False)['销量'].sum().reset_index(),
+        'biz_share': build_share_table(biz, '单只价格区间'),
+        'strategy': build_strategy_table(data, age),
+        'triple': build_triple_table(biz),
+    }
+    if 'ASIN' in data.columns:
+        tables['asin_matrix'] = build_asin_matrix(data, age)
+    if '季度' in data.columns:
+        _, conc_df = build_leaderboard(data, top_n)
+        seg_conc, quarter_stats = build_struct_table(conc_df, age, years, top_n)
+        tables['seg_conc'] = seg_conc
+        tables['quarter_stats'] = quarter_stats
+        tables['top_trend'] = quarter_stats[quarter_stats['产品类型'] == f'Top{top_n}头部'].sort_values('季度')
+    return tables
+
+def render_report_figure(builder, tables):
+    """在工作进程中构建单张图表，只序列化一次，返回 plotly 图表 JSON 字符串"""
+    return pio.to_json(builder(tables), validate=False)
+
+def report_figure_div(div_id, fig_json):
+    """由同一份图表 JSON 生成 HTML 片段，不再二次序列化（转义 "</" 防止提前结束 script 标签）"""
+    safe_json = fig_json.replace('</', '<\\/')
+    return (
+        f'<div id="{div_id}" class="plotly-graph-div"></div>\n'
+        f'<script type="text/javascript">(function() {{ var fig = {safe_json}; '
+        f'Plotly.newPlot("{div_id}", fig.data, fig.layout, {{"responsive": true}}); }})();</script>'
+    )
+
+def build_report(data, years, ages, top_n=15, max_workers=8):
+    """生成自包含 HTML 报告与图表 JSON；每个分类的数据表只算一次，全部图表并行构建"""
+    # 1. 数据表：每个 是否8+ 分类计算一次，供该分类下所有图表共享
+    tables_by_age = {age: build_report_tables(data, years, age, top_n) for age in ages}
+
+    # 2. 图表：plotly 构图是受 GIL 限制的纯 Python 计算，线程无法并行，因此使用多进程。
+    #    采用 fork 启动，子进程直接继承已加载的脚本模块；spawn 会在子进程里重跑整个
+    #    Streamlit 脚本，因此不支持 fork 的平台或单核机器上改为串行构建
+    jobs = [
+        (age, key, title, builder)
+        for age in ages
+        for key, title, table_key, builder in report_figures
+        if table_key in tables_by_age[age] and len(tables_by_age[age][table_key]) > 0
+    ]
+    builders = [builder for _, _, _, builder in jobs]
+    job_tables = [tables_by_age[age] for age, _, _, _ in jobs]
+    workers = min(max_workers, os.cpu_count() or 1, len(jobs))
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            results = list(pool.map(render_report_figure, builders, job_tables))
+    else:
+        results = [render_report_figure(builder, tables) for builder, tables in zip(builders, job_tables)]
+
+    # 3. 汇总：HTML 按分类分节，JSON 按 分类 -> 图表键 组织；图表 JSON 字符串直接拼接，不再解析重编码
+    generated_at = datetime.now().strftime('%Y-%m-%d %H:%M')
+    meta = {'years': list(years), 'ages': list(ages), 'top_n': top_n, 'generated_at': generated_at}
+    sections = {age: [] for age in ages}
+    figure_entries = {age: [] for age in ages}
+    for i, ((age, key, title, _), fig_json) in enumerate(zip(jobs, results)):
+        sections[age].append(f"<h3>{title}</h3>\n<div class=\"chart\">{report_figure_div(f'chart-{i}', fig_json)}</div>")
+        figure_entries[age].append(
+            f'{json.dumps(key)}: {{"title": {json.dumps(title, ensure_ascii=False)}, "figure": {fig_json}}}'
+        )
+    report_json = (
+        f'{{"meta": {json.dumps(meta, ensure_ascii=False)}, "figures": {{'
+        + ', '.join(f'{json.dumps(age, ensure_ascii=False)}: {{{", ".join(figure_entries[age])}}}' for age in ages)
+        + '}}'
+    )
+
+    body = "\n".join(
+        f"<h2>市场分类 (是否8+)：{age}</h2>\n" + "\n".join(sections[age]) for age in ages
+    )
+    report_html = f"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>酒精笔市场趋势监测报告</title>
+<script type="text/javascript">{get_plotlyjs()}</script>
+<style>
+body {{ font-family: sans-serif; margin: 24px 48px; }}
+h2 {{ border-bottom: 2px solid #1f77b4; padding-bottom: 4px; margin-top: 48px; }}
+.chart {{ margin-bottom: 32px; }}
+</style>
+</head>
+<body>
+<h1>📊 酒精笔市场趋势监测报告</h1>
+<p>年份：{'、'.join(years)} | Top-N：{top_n} | 生成时间：{generated_at}</p>
+{body}
+</body>
+</html>"""
+    return report_html, report_json
 
 df = load_data()
+if not df.empty:
+    asin_index = load_asin_index()
 
 # --- 3. 侧边栏 (全局核心筛选) ---
 st.sidebar.header("🎛️ 全局核心筛选")
@@ -60,7 +801,7 @@ if not df.empty:
     
     selected_age = st.sidebar.radio("2. 市场分类 (是否8+)", ["全部", "是", "否"], index=0)
     
-    mask = df['month(month)'].str[:4].isin(selected_years)
+    mask = df['month(month)'].str[:4].isin(selected_years) & ((df['数据问题'] & duplicate_issue_mask) == 0)
     if selected_age != "全部":
         mask &= (df['是否8+'] == selected_age)
     
@@ -68,6 +809,24 @@ if not df.empty:
 else:
     st.stop()
 
+# --- 数据质量检查汇总 ---
+with st.expander(f"🩺 数据质量检查：{int((df['数据问题'] > 0).sum())} / {len(df)} 行存在问题"):
+    flag_cols = st.columns(len(issue_flags) + 1)
+    for col, (name, bit) in zip(flag_cols, issue_flags.items()):
+        col.metric(name, f"{int(((df['数据问题'] & bit) > 0).sum())} 行")
+    flag_cols[-1].metric("缺失月份合计", f"{int(df['缺失月数'].sum())} 个月")
+
+    # 问题明细：将位掩码还原为可读说明
+    issue_rows = df[df['数据问题'] > 0].copy()
+    issue_rows['问题说明'] = ''
+    for name, bit in issue_flags.items():
+        issue_rows.loc[(issue_rows['数据问题'] & bit) > 0, '问题说明'] += name + '；'
+    st.dataframe(
+        issue_rows[['ASIN', 'month(month)', '是否8+', '笔头类型', '销量', '单只价格', '缺失月数', '问题说明']],
+        use_container_width=True, hide_index=True
+    )
+    st.caption("“重复剔除”的行不参与任何统计；“单只价格无效”的行不参与单只定价分析；“价量异常 / 月份无效”的行额外不参与战略定位测算。")
+
 # --- 4. 看板布局 ---
 
 # --- 板块一：笔尖类型 ---
@@ -83,38 +842,11 @@ st.plotly_chart(tip_pie, use_container_width=True)
 # 2. 【新增】市场份额演变：动态结构分析
 st.subheader("📈 笔头类型市场份额推移")
 
-# 聚合数据：按月和笔头类型统计销量
-tip_share_data = filtered_df.groupby(['时间轴', '笔头类型'])['销量'].sum().reset_index()
-
-# 计算每月总销量，用于计算占比（归一化）
-monthly_total = tip_share_data.groupby('时间轴')['销量'].transform('sum')
-tip_share_data['占比'] = tip_share_data['销量'] / monthly_total
+# 聚合数据：按月和笔头类型统计销量，并计算每月占比
+tip_share_data = build_share_table(filtered_df, '笔头类型')
 
 # 绘制堆积面积图
-fig_tip_share = go.Figure()
-tip_types = sorted(tip_share_data['笔头类型'].unique())
-
-for tip in tip_types:
-    sub_df = tip_share_data[tip_share_data['笔头类型'] == tip]
-    fig_tip_share.add_trace(go.Scatter(
-        x=sub_df['时间轴'], 
-        y=sub_df['占比'], 
-        name=tip,
-        stackgroup='one',  # 开启堆积模式
-        mode='lines',
-        fill='tonexty',
-        hovertemplate=f"笔头: {tip}<br>份额: %{{y:.1%}}<extra></extra>"
-    ))
-
-fig_tip_share.update_layout(
-    xaxis_title="时间轴",
-    yaxis_title="市场份额占比",
-    yaxis_tickformat='.0%',  # 纵坐标显示百分比
-    hovermode="x unified",    # 悬浮时显示该时间点所有数据
-    height=450,
-    template="plotly_white",
-    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-)
+fig_tip_share = build_share_area_fig(tip_share_data, '笔头类型', sorted(tip_share_data['笔头类型'].unique()), '笔头')
 st.plotly_chart(fig_tip_share, use_container_width=True)
 
 
@@ -151,45 +883,9 @@ st.info("💡 系统已自动筛选销量前 10 的规格。")
 # 图表 1：市场份额变化 (固定显示 Top 10，不受局部按钮影响)
 st.subheader("📊 核心规格市场份额推移")
 
-spec_total = filtered_df.groupby('支数')['销量'].sum().sort_values(ascending=False).reset_index()
-
-top_10_specs = spec_total.head(10)['支数'].tolist()
-
-spec_data_all = filtered_df[filtered_df['支数'].isin(top_10_specs)].groupby(['时间轴', '支数'])['销量'].sum().reset_index()
+top_10_specs, spec_data_all = build_spec_table(filtered_df)
 
-
-
-total_monthly_all = spec_data_all.groupby('时间轴')['销量'].transform('sum')
-
-spec_data_all['占比'] = spec_data_all['销量'] / total_monthly_all.replace(0, np.nan)
-
-
-
-fig_spec_area = go.Figure()
-
-for cat in sorted(spec_data_all['支数'].unique()):
-
-    df_sub = spec_data_all[spec_data_all['支数'] == cat]
-
-    fig_spec_area.add_trace(go.Scatter(
-    x=df_sub['时间轴'], 
-    y=df_sub['占比'], 
-    name=f"{cat}支",
-    stackgroup='one', 
-    fill='tonexty', 
-    hoveron='points',
-    customdata=df_sub['销量'],
-    # 重点：加入 时间: %{x}
-    hovertemplate=(
-        "时间: %{x}<br>"
-        "规格: %{fullData.name}<br>"
-        "占比: %{y:.1%}<br>"
-        "销量: %{customdata:,.0f}"
-        "<extra></extra>"
-    )
-))
-
-fig_spec_area.update_layout(hovermode="closest", yaxis_tickformat='.0%', height=500)
+fig_spec_area = build_spec_share_fig(spec_data_all)
 
 st.plotly_chart(fig_spec_area, use_container_width=True)
 # 局部按钮 (多选模式)
@@ -218,41 +914,11 @@ st.plotly_chart(fig_pie_price, use_container_width=True)
 # 2. 【新增】价格段市场份额推移：动态结构分析
 st.subheader("📈 价格段市场份额演变")
 
-# 聚合数据：按月和价格段统计销量
-price_share_data = filtered_df.groupby(['时间轴', '价格段'])['销量'].sum().reset_index()
-
-# 计算每月总销量，用于归一化百分比
-monthly_total_price = price_share_data.groupby('时间轴')['销量'].transform('sum')
-price_share_data['占比'] = price_share_data['销量'] / monthly_total_price
+# 聚合数据：按月和价格段统计销量，并归一化为百分比
+price_share_data = build_share_table(filtered_df, '价格段')
 
-# 为了绘图美观，对价格段进行排序（确保 0-4.99 在最下面，>=70 在最上面）
-price_order = ['0-4.99', '5-9.99', '10-14.99', '15-19.99', '20-24.99', '25-29.99', '30-34.99', '35-39.99', '40-69.99', '>=70']
-# 只保留数据中存在的价格段
-existing_prices = [p for p in price_order if p in price_share_data['价格段'].unique()]
-
-fig_price_share = go.Figure()
-
-for price_range in existing_prices:
-    sub_df = price_share_data[price_share_data['价格段'] == price_range]
-    fig_price_share.add_trace(go.Scatter(
-        x=sub_df['时间轴'], 
-        y=sub_df['占比'], 
-        name=price_range,
-        stackgroup='one', # 开启堆积
-        mode='lines',
-        fill='tonexty',
-        hovertemplate=f"价格段: {price_range}<br>份额: %{{y:.1%}}<extra></extra>"
-    ))
-
-fig_price_share.update_layout(
-    xaxis_title="时间轴",
-    yaxis_title="市场份额占比",
-    yaxis_tickformat='.0%',
-    hovermode="x unified",
-    height=500,
-    template="plotly_white",
-    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-)
+# 按 price_order 堆叠，只保留数据中存在的价格段
+fig_price_share = build_share_area_fig(price_share_data, '价格段', price_order, '价格段', height=500)
 st.plotly_chart(fig_price_share, use_container_width=True)
 
 
@@ -286,19 +952,8 @@ st.markdown("---")
 # --- 板块四：单只价格精细分析 (最新业务逻辑) ---
 st.header("4️⃣ 单只定价区间分析")
 
-# 1. 过滤异常数据与准备
-biz_df = filtered_df[filtered_df['单只价格'].notna() & (filtered_df['单只价格'] > 0)].copy()
-
-# 定义标签顺序，确保图表堆叠逻辑从低价到高价
-biz_price_order = [
-    '1. 超低价走量款 (≤0.25)', 
-    '2. 大众平价款 (0.25-0.5]', 
-    '3. 标准办公款 (0.5-1.0]', 
-    '4. 品质进阶款 (1.0-2.0]', 
-    '5. 中端功能款 (2.0-4.0]', 
-    '6. 中高端款 (4.0-6.0]', 
-    '7. 高端/奢侈款 (>6.0)'
-]
+# 1. 按数据质量标记剔除价格无效行
+biz_df = filtered_df[(filtered_df['数据问题'] & price_issue_mask) == 0].copy()
 
 tab_dist, tab_trend = st.tabs(["📊 销量占比分布", "📈 市场趋势推移"])
 
@@ -307,13 +962,8 @@ with tab_dist:
     with col_a:
         st.subheader("🎯 单只定价区间销量对比")
         # 柱状图：展示各区间总销量
-        price_dist_fig = px.bar(
-            biz_df.groupby('单只价格区间', observed=False)['销量'].sum().reset_index(),
-            x='单只价格区间', y='销量', 
-            color='单只价格区间',
-            text_auto='.2s',
-            title="哪个定价带最能出单？",
-            category_orders={"单只价格区间": biz_price_order}
+        price_dist_fig = build_biz_dist_fig(
+            biz_df.groupby('单只价格区间', observed=False)['销量'].sum().reset_index()
         )
         st.plotly_chart(price_dist_fig, use_container_width=True)
     
@@ -332,32 +982,9 @@ with tab_trend:
     # --- 新增：单只定价份额演变（面积图） ---
     st.subheader("📈 单只价格区间份额演变")
     
-    # 计算份额数据
-    biz_share_data = biz_df.groupby(['时间轴', '单只价格区间'], observed=False)['销量'].sum().reset_index()
-    biz_monthly_total = biz_share_data.groupby('时间轴')['销量'].transform('sum')
-    biz_share_data['占比'] = biz_share_data['销量'] / biz_monthly_total
-
-    fig_biz_share = go.Figure()
-    # 按照业务逻辑顺序堆叠
-    existing_biz_labels = [l for l in biz_price_order if l in biz_share_data['单只价格区间'].unique()]
-    
-    for label in existing_biz_labels:
-        sub_df = biz_share_data[biz_share_data['单只价格区间'] == label]
-        fig_biz_share.add_trace(go.Scatter(
-            x=sub_df['时间轴'], y=sub_df['占比'], 
-            name=label,
-            stackgroup='one',
-            mode='lines',
-            fill='tonexty',
-            hovertemplate=f"区间: {label}<br>份额: %{{y:.1%}}<extra></extra>"
-        ))
-    
-    fig_biz_share.update_layout(
-        xaxis_title="时间轴", yaxis_title="市场份额",
-        yaxis_tickformat='.0%', hovermode="x unified",
-        height=450, template="plotly_white",
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
+    # 计算份额数据，按照业务逻辑顺序堆叠
+    biz_share_data = build_share_table(biz_df, '单只价格区间')
+    fig_biz_share = build_share_area_fig(biz_share_data, '单只价格区间', biz_price_order, '区间')
     st.plotly_chart(fig_biz_share, use_container_width=True)
 
 # --- 2. 【核心修改】细分单价销量走势对比：改为按键操作模式 ---
@@ -402,84 +1029,10 @@ st.markdown("---")
 st.markdown("---")
 st.header("🚀 战略定位：细分蓝海机会识别")
 
-# 提取年份
-df['year_int'] = df['month(month)'].astype(str).str[:4].astype(int)
-
-# 1. 自动定义“今年”和“去年”
-latest_year = df['year_int'].max() 
-prev_year = latest_year - 1
-
-# 2. 人群筛选过滤
-age_val = selected_age 
-if age_val != "全部":
-    base_calc_df = df[df['是否8+'] == age_val].copy()
-else:
-    base_calc_df = df.copy()
-
-# 3. 分组聚合：增加对“月份数”的统计，用于计算月均值
-# 今年数据：统计总销量和今年该产品卖了几个月
-current_growth = base_calc_df[base_calc_df['year_int'] == latest_year].groupby(['支数', '笔头类型']).agg({
-    '销量': 'sum', 
-    '销售额': 'sum',
-    'month(month)': 'nunique'  # 统计今年活跃了几个月
-}).reset_index().rename(columns={'month(month)': '今年活跃月数'})
-
-# 去年数据：统计总销量和去年该产品卖了几个月
-prev_growth = base_calc_df[base_calc_df['year_int'] == prev_year].groupby(['支数', '笔头类型']).agg({
-    '销量': 'sum',
-    'month(month)': 'nunique'  # 统计去年活跃了几个月
-}).reset_index().rename(columns={'销量': '去年销量', 'month(month)': '去年活跃月数'})
-
-# 4. 合并计算
-strat_df = pd.merge(current_growth, prev_growth, on=['支数', '笔头类型'], how='left').fillna(0)
-
-# --- 核心逻辑切换：月均销量 ---
-# 计算月均值（防止分母为0）
-strat_df['今年月均'] = strat_df['销量'] / strat_df['今年活跃月数']
-strat_df['去年月均'] = strat_df['去年销量'] / strat_df['去年活跃月数'].replace(0, np.nan)
-
-# A. 同比增长率：现在是基于“月均效率”的增长
-strat_df['同比增长率'] = (strat_df['今年月均'] - strat_df['去年月均']) / strat_df['去年月均']
-
-# B. 市场份额：依然基于今年总销量，反映实际市场地位
-strat_df['市场份额'] = strat_df['销量'] / strat_df['销量'].sum()
-
-# C. 增长贡献率：基于总增量，反映对大盘贡献的物理支柱作用
-total_delta = strat_df['销量'].sum() - strat_df['去年销量'].sum()
-strat_df['增长贡献率'] = (strat_df['销量'] - strat_df['去年销量']) / (total_delta if total_delta != 0 else 1)
-
-# --- 战略过滤 ---
-# 过滤掉销量极低或增长率极其离谱的杂讯
-plot_df = strat_df[
-    (strat_df['销量'] > 100) & 
-    (strat_df['同比增长率'] < 100) # 过滤掉月均增长超过100倍的离群值
-].copy()
-
-# 5. 绘图
-fig_strat = px.scatter(
-    plot_df, 
-    x='市场份额',
-    y='同比增长率',
-    size='销量',
-    color='增长贡献率',
-    facet_col='笔头类型',
-    hover_name='支数',
-    # 悬浮框增加月均信息
-    hover_data={'今年活跃月数': True, '今年月均': ':.1f', '去年月均': ':.1f'},
-    color_continuous_scale='RdBu', 
-    color_continuous_midpoint=0, 
-    range_color=[-0.8, 0.8], # 饱和点设在80%贡献率
-    title=f"战略定位：{latest_year} vs {prev_year} (月均增长逻辑)",
-    labels={'市场份额': '市场份额 (重要性)', '同比增长率': '月均销量增长 (爆发力)'},
-    height=600,
-    template="plotly_white"
-)
-
-# 视觉增强
-fig_strat.update_traces(marker=dict(line=dict(width=1, color='DarkSlateGrey'), opacity=0.85))
-fig_strat.add_hline(y=0, line_dash="dash", line_color="black", opacity=0.3)
-fig_strat.update_layout(coloraxis_colorbar=dict(title="贡献率(深蓝优)", tickformat=".0%"))
+# 今年 vs 去年 的月均增长、份额与贡献率（按侧边栏人群筛选，结果缓存）
+plot_df, latest_year, prev_year = build_strategy_table(df, selected_age)
 
+fig_strat = build_strategy_fig(plot_df, latest_year, prev_year)
 st.plotly_chart(fig_strat, use_container_width=True)
 
 st.info("💡 **月均增长逻辑已启用**：Y轴反映的是单月销量的平均增幅。即使是今年新上架的产品，也能与其在架期间的平均表现进行公平对比。")
@@ -489,30 +1042,8 @@ st.markdown("---")
 st.header("🔬 深度定义：规格 x 定价 x 笔尖 交叉博弈")
 
 if not biz_df.empty:
-    # 聚合数据：支数(X), 单只单价(Y), 笔头类型(分栏), 价格段(颜色)
-    triple_data = biz_df.groupby(['支数', '笔头类型', '价格段'], observed=False).agg({
-        '销量': 'sum',
-        '单只价格': 'mean' 
-    }).reset_index()
-
-    triple_data = triple_data[triple_data['销量'] > 100]
-
-    fig_triple = px.scatter(
-        triple_data,
-        x='支数',
-        y='单只价格',
-        size='销量',
-        color='价格段', 
-        facet_col='笔头类型', 
-        title="第三层：定义产品 (寻找高销量、高溢价的配置组合)",
-        labels={'支数': '包装规格(支)', '单只价格': '平均单支售价(元)'},
-        height=600,
-        size_max=40,
-        template="plotly_white",
-        category_orders={"价格段": ['0-4.99', '5-9.99', '10-14.99', '15-19.99', '20-24.99', '25-29.99', '30-34.99', '35-39.99', '40-69.99', '>=70']}
-    )
-
-    fig_triple.update_layout(hovermode="closest")
+    triple_data = build_triple_table(biz_df)
+    fig_triple = build_triple_fig(triple_data)
     st.plotly_chart(fig_triple, use_container_width=True)
 else:
     st.warning("当前筛选条件下无可用数据。")
@@ -529,188 +1060,48 @@ import streamlit as st
 st.markdown("---")
 st.header("🎯 ASIN 矩阵：爆款潜力挖掘")
 
-id_col = 'ASIN' 
-month_col = 'month(month)' 
-
-# 预定义的新品列表
-new_asin_list = [
-    "B0FL78FF2F", "B0DP9BMKJR", "B0FB8LM5ZR", "B0FL2GLMPZ", "B0FDKM2Q3V",
-    "B0DP9FDTT3", "B0F4X5NMCF", "B0F3JFHGCP", "B0FDG8XJPS", "B0FGHQCR1C",
-    "B0FH4PYS7Q", "B0FH9MB9LD", "B0FJQM9LVB", "B0FJQXT63G"]
-
-if id_col in df.columns and month_col in df.columns:
-    # 1. 定义固定 12 个月区间
-    target_12_months = [
-        '202412', '202501', '202502', '202503', '202504', '202505', 
-        '202506', '202507', '202508', '202509', '202510', '202511'
-    ]
-    
-    matrix_base_df = df[df[month_col].astype(str).isin(target_12_months)].copy()
-    
-    # 同步侧边栏人群筛选（假设 side bar 已定义 selected_age）
-    if 'selected_age' in locals() and selected_age != "全部":
-        matrix_base_df = matrix_base_df[matrix_base_df['是否8+'] == selected_age]
-    
-    asin_stats = []
-    # 第一步：遍历计算每个 ASIN 的基础统计值
-    for asin, group in matrix_base_df.groupby(id_col):
-        # 核心指标：该 ASIN 在这 12 个月里实际出现了几个月？
-        m_sales_series = group.groupby(month_col)['销量'].sum().sort_index()
-        active_months = len(m_sales_series)
-        
-        # Y 轴：月平均销量
-        avg_sales = m_sales_series.mean()
-        
-        # X 轴：月度趋势得分 (RLM 回归)
-        m_sales = m_sales_series.values
-        if active_months > 1:
-            x = np.arange(len(m_sales))
-            x_with_const = sm.add_constant(x)
-            try:
-                model = sm.RLM(m_sales, x_with_const).fit()
-                trend_score = model.params[1]
-            except:
-                trend_score = 0
-        else:
-            trend_score = 0
-            
-        asin_stats.append({
-            'ASIN': asin,
-            '销售趋势得分': trend_score,
-            '月均销量': avg_sales,
-            '活跃月份数': active_months  # 【新增】记录生存时长
-        })
+if 'ASIN' in df.columns and 'month(month)' in df.columns:
+    # 逐 ASIN 统计与分类（固定 12 个月区间，同步侧边栏人群筛选）
+    matrix_df = build_asin_matrix(df, selected_age)
 
-    if asin_stats:
-        plot_df = pd.DataFrame(asin_stats)
-        
-        # --- 第二步：分类边界定义 ---
-        x_p25 = plot_df['销售趋势得分'].quantile(0.25)
-        x_p75 = plot_df['销售趋势得分'].quantile(0.75)
-        x_median = plot_df['销售趋势得分'].median()
-        x_mean = plot_df['销售趋势得分'].mean()
-        y_median = plot_df['月均销量'].median()
-        y_mean = plot_df['月均销量'].mean()
-
-        def classify_asin(row):
-            # 优先判定为手动指定的新品
-            if row['ASIN'] in new_asin_list:
-                return '新品 (90天)'
-            
-            # 【优化点】：只有销售时长 >= 4 个月的产品，才有资格评选“稳定产品”
-            # 活跃月份太短的产品（即便得分平稳）统一划入“动态/待观察”
-            if row['活跃月份数'] >= 4:
-                if x_p25 <= row['销售趋势得分'] <= x_p75:
-                    return '稳定产品'
-            
-            return '动态产品'
-
-        plot_df['产品类型'] = plot_df.apply(classify_asin, axis=1)
-
-        # --- 第三步：绘图 ---
-        fig_matrix = go.Figure()
-
-        color_map = {'动态产品': '#8c8cb4', '稳定产品': '#f2c977', '新品 (90天)': '#d65a5a'}
-        symbol_map = {'动态产品': 'circle', '稳定产品': 'square', '新品 (90天)': 'triangle-up'}
-
-        for t in ['稳定产品', '动态产品', '新品 (90天)']:
-            curr_df = plot_df[plot_df['产品类型'] == t]
-            if not curr_df.empty:
-                fig_matrix.add_trace(go.Scatter(
-                    x=curr_df['销售趋势得分'],
-                    y=curr_df['月均销量'],
-                    mode='markers',
-                    name=t,
-                    marker=dict(color=color_map[t], symbol=symbol_map[t], size=10, opacity=0.8),
-                    text=curr_df['ASIN'],
-                    customdata=curr_df['活跃月份数'], # 传入活跃月份
-                    hovertemplate=(
-                        "<b>ASIN: %{text}</b><br>" +
-                        "活跃月份数: %{customdata}月<br>" +
-                        "月度趋势得分: %{x:.2f}<br>" +
-                        "月均销量: %{y:.0f}<br>" +
-                        "分类: " + t + "<extra></extra>"
-                    )
-                ))
-
-        # --- 第四步：视觉辅助线 ---
-        fig_matrix.add_vline(x=x_p25, line_dash="dash", line_color="red", line_width=0.8,
-                             annotation_text=f"P25: {x_p25:.2f}", annotation_position="top left")
-        fig_matrix.add_vline(x=x_median, line_color="red", line_width=1.5,
-                             annotation_text=f"<b>中位数: {x_median:.2f}</b>", annotation_position="top")
-        fig_matrix.add_vline(x=x_p75, line_dash="dash", line_color="red", line_width=0.8,
-                             annotation_text=f"P75: {x_p75:.2f}", annotation_position="top right")
-        fig_matrix.add_hline(y=y_median, line_color="#4a90e2", line_width=1.5,
-                             annotation_text=f"销量中位数: {y_median:,.0f}", annotation_position="right")
-
-        # 布局设置
-        fig_matrix.update_layout(
-            template="plotly_white",
-            title=f"产品矩阵分析 (固定周期: 202412 - 202511 | 稳定产品门槛: 活跃≥4个月)",
-            xaxis_title="销售趋势得分 (月度增长斜率)",
-            yaxis_title="月度平均销量",
-            height=700,
-            margin=dict(r=120, t=100),
-            xaxis=dict(range=[plot_df['销售趋势得分'].min()*1.2 - 1, plot_df['销售趋势得分'].max()*1.2 + 1]),
-            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    if not matrix_df.empty:
+        fig_matrix = build_matrix_fig(matrix_df)
+        matrix_event = st.plotly_chart(
+            fig_matrix, use_container_width=True,
+            on_select="rerun", selection_mode="points", key="asin_matrix_chart"
         )
-
-        st.plotly_chart(fig_matrix, use_container_width=True)
+        # 点选散点即可在下方 ASIN 下钻中查看该产品
+        matrix_points = matrix_event.selection.points if matrix_event else []
+        pick_drill_asin('matrix', matrix_points[0]['customdata'][1] if matrix_points else None)
+        st.caption("💡 点击散点可在下方「ASIN 下钻」中查看该产品的逐月表现。")
 else:
     st.error("数据缺失 ASIN 或 月份列，请检查数据源。")
 
 
-# --- 6. 核心结构演变：Top15 季度竞争格局状况 ---
+# --- 6. 核心结构演变：Top-N 季度竞争格局状况 ---
 st.markdown("---")
-st.header("⚖️ 核心结构演变：Top15 季度竞争格局状况")
+st.header("⚖️ 核心结构演变：Top-N 季度竞争格局状况")
 
-# 定义你的 Top15 ASIN 列表
-top15_asins = [
-    "B07ZYFXLZ6", "B073TW8QHV", "B07NRB5G3Q", "B0BWH7CWFW", "B0BG7118BK",
-    "B01H1NV1RE", "B08P4J7X8T", "B0BW87BYSN", "B074TC3LSR", "B07VK1G863",
-    "B077S1NH7H", "B07RSV32MD", "B086JJVQPF", "B08YDDCBDZ", "B01GRF7NRY"
-]
+# 榜单规模可调，默认保持 Top15（报告导出同样沿用）
+top_n = st.slider("榜单规模 (Top-N)", min_value=5, max_value=30, value=15, step=5)
 
 # 检查数据中是否存在“季度”列
 if '季度' in filtered_df.columns:
-    # 1. 标记是否为 Top15 产品
-    struct_df = filtered_df.copy()
-    struct_df['产品类型'] = struct_df['ASIN'].apply(lambda x: 'Top15头部' if x in top15_asins else '其他长尾产品')
+    top_label = f'Top{top_n}头部'
 
-    # 2. 按季度聚合销量
-    # 注意：这里需要按季度排序，确保图表横轴逻辑正确
-    quarter_stats = struct_df.groupby(['季度', '产品类型'])['销量'].sum().reset_index()
-    
-    # 3. 计算每个季度的贡献占比
-    quarter_total = quarter_stats.groupby('季度')['销量'].transform('sum')
-    quarter_stats['贡献占比'] = quarter_stats['销量'] / quarter_total
+    # 1. 由数据驱动计算每季度滚动榜单 (全量聚合结果已缓存，这里只按筛选条件切片)
+    rank_df, conc_df = build_leaderboard(df, top_n)
 
-    # 4. 绘制季度结构演变堆积柱状图
-    fig_struct = px.bar(
-        quarter_stats, 
-        x='季度', 
-        y='销量', 
-        color='产品类型',
-        title="各季度市场结构演变 (Top15 vs 其他)",
-        color_discrete_map={'Top15头部': '#1f77b4', '其他长尾产品': '#e5ecf6'},
-        barmode='relative',
-        text_auto='.2s'
-    )
-    
-    # 5. 绘制贡献占比折线图（次坐标轴思想，通过两个图表并行展示）
-    # 提取 Top15 的占比趋势
-    top15_trend = quarter_stats[quarter_stats['产品类型'] == 'Top15头部'].sort_values('季度')
-    
-    fig_ratio = px.line(
-        top15_trend,
-        x='季度',
-        y='贡献占比',
-        markers=True,
-        title="Top15 市场销量贡献率走势 (%)",
-        text=top15_trend['贡献占比'].apply(lambda x: f"{x:.1%}")
-    )
-    fig_ratio.update_traces(textposition="top center", line_color='#d65a5a', line_width=3)
-    fig_ratio.update_layout(yaxis_tickformat='.0%', yaxis_range=[0, 1])
+    # 2. 头部 vs 长尾的季度销量结构与贡献占比
+    seg_conc, quarter_stats = build_struct_table(conc_df, selected_age, selected_years, top_n)
+
+    # 3. 绘制季度结构演变堆积柱状图
+    fig_struct = build_struct_fig(quarter_stats, top_n)
+
+    # 4. 绘制贡献占比折线图（次坐标轴思想，通过两个图表并行展示）
+    # 提取 Top-N 的占比趋势
+    top_trend = quarter_stats[quarter_stats['产品类型'] == top_label].sort_values('季度')
+    fig_ratio = build_ratio_fig(top_trend, top_n)
 
     # 布局展示
     col_left, col_right = st.columns([3, 2])
@@ -719,16 +1110,176 @@ if '季度' in filtered_df.columns:
     with col_right:
         st.plotly_chart(fig_ratio, use_container_width=True)
 
-    # 6. 自动诊断逻辑
-    latest_ratio = top15_trend['贡献占比'].iloc[-1] if not top15_trend.empty else 0
-    avg_ratio = top15_trend['贡献占比'].mean() if not top15_trend.empty else 0
+    # 5. 市场集中度：CR5 / CR10 (左轴) 与 HHI (右轴)
+    st.subheader("📐 市场集中度推移 (CR5 / CR10 / HHI)")
+    st.plotly_chart(build_conc_fig(seg_conc), use_container_width=True)
+
+    # 6. 榜单明细与季度进出榜
+    tab_rank, tab_move = st.tabs([f"🏆 各季度 Top{top_n} 榜单", "🔄 季度进出榜变动"])
+    with tab_rank:
+        seg_rank = rank_df[
+            (rank_df['是否8+'] == selected_age) &
+            (rank_df['季度'].str[:4].isin(selected_years))
+        ]
+        rank_pivot = seg_rank.pivot(index='排名', columns='季度', values='ASIN')
+        rank_event = st.dataframe(
+            rank_pivot, use_container_width=True,
+            on_select="rerun", selection_mode="single-cell", key="top_rank_table"
+        )
+        # 点选榜单单元格即可下钻到对应 ASIN
+        rank_cells = rank_event.selection.cells if rank_event else []
+        rank_asin = rank_pivot.iloc[rank_cells[0][0]][rank_cells[0][1]] if rank_cells else None
+        pick_drill_asin('top_rank', rank_asin if isinstance(rank_asin, str) else None)
+        st.caption("💡 点击榜单中的 ASIN 可在下方「ASIN 下钻」中查看详情。")
+    with tab_move:
+        st.dataframe(
+            seg_conc[['季度', '新进榜数', '跌出榜数', '新进榜ASIN', '跌出榜ASIN']].set_index('季度'),
+            use_container_width=True
+        )
+
+    # 7. 自动诊断逻辑
+    latest_ratio = top_trend['贡献占比'].iloc[-1] if not top_trend.empty else 0
+    avg_ratio = top_trend['贡献占比'].mean() if not top_trend.empty else 0
+    latest_hhi = seg_conc['HHI'].iloc[-1] if not seg_conc.empty else 0
     
     st.info(f"""
     **🔍 季度结构诊断：**
-    - **当前份额**：最近一个季度 Top15 占据了市场 **{latest_ratio:.1%}** 的销量。
-    - **历史均值**：Top15 的平均贡献水平在 **{avg_ratio:.1%}**。
+    - **当前份额**：最近一个季度 Top{top_n} 占据了市场 **{latest_ratio:.1%}** 的销量。
+    - **历史均值**：Top{top_n} 的平均贡献水平在 **{avg_ratio:.1%}**。
+    - **集中度**：最近一个季度 HHI 为 **{latest_hhi:,.0f}**（< 1500 为竞争型市场，> 2500 为高度集中）。
     - **格局提示**：{'⚠️ 头部效应正在加强，市场进入壁垒极高。' if latest_ratio > avg_ratio else '✅ 头部份额有所松动，新进产品存在突围空间。'}
-    - **判断标准**：若 Top15 长期贡献 > 50%，说明增长严重依赖头部玩家，属于“存量收割”市场。
+    - **判断标准**：若 Top{top_n} 长期贡献 > 50%，说明增长严重依赖头部玩家，属于“存量收割”市场。
     """)
 else:
     st.error("数据集中未找到名为 '季度' 的列，请检查 Excel 表头。")
+
+
+# --- 7. ASIN 下钻：单品逐月表现 ---
+st.markdown("---")
+st.header("🔎 ASIN 下钻：单品历史表现")
+
+col_search, col_pick = st.columns([1, 2])
+with col_search:
+    asin_prefix = st.text_input("ASIN 前缀搜索", placeholder="例如 B07Z").strip().upper()
+drill_options, match_count = search_asins(asin_index, asin_prefix)
+shown_count = len(drill_options)
+drill_asin = st.session_state.get('drill_asin')
+if drill_asin and drill_asin not in drill_options:
+    drill_options = [drill_asin] + drill_options
+with col_pick:
+    selected_drill = st.selectbox(
+        f"选择 ASIN（共匹配 {match_count} 个" +
+        (f"，仅列出前 {shown_count} 个，输入前缀可缩小范围）" if match_count > shown_count else "）"),
+        drill_options,
+        index=drill_options.index(drill_asin) if drill_asin in drill_options else None,
+        placeholder="从矩阵 / 榜单点选，或在此选择"
+    )
+if selected_drill:
+    st.session_state['drill_asin'] = selected_drill
+
+if selected_drill:
+    # 索引查询：只取该 ASIN 的连续行区间（包含全部 是否8+ 分类与年份），重复记录只保留首行
+    asin_rows = lookup_asin(asin_index, selected_drill)
+    asin_rows = asin_rows[(asin_rows['数据问题'] & duplicate_issue_mask) == 0]
+    latest_row = asin_rows.iloc[-1]
+
+    # 1. 月度汇总：销量求和，单只价格只取通过价格校验的行
+    valid_price = asin_rows['单只价格'].where((asin_rows['数据问题'] & price_issue_mask) == 0)
+    asin_monthly = asin_rows.assign(有效单价=valid_price).groupby('时间轴').agg(
+        销量=('销量', 'sum'), 单只价格=('有效单价', 'mean')
+    ).reset_index()
+    # 真实月份序号 (年*12+月)，缺失月份不会被压缩成相邻观测
+    asin_monthly['月序号'] = (
+        pd.to_numeric(asin_monthly['时间轴'].str[:4], errors='coerce') * 12 +
+        pd.to_numeric(asin_monthly['时间轴'].str[5:], errors='coerce')
+    )
+
+    # 2. 价格趋势拟合 (RLM 回归，与 ASIN 矩阵一致)，自变量为真实月份序号，斜率即每月变化
+    #    RLM 需要 3 个以上观测（2 点时残差自由度为 0），2 点时退化为直线连接
+    price_hist = asin_monthly.dropna(subset=['单只价格', '月序号'])
+    price_slope, price_fit = None, None
+    month_offset = price_hist['月序号'].values - price_hist['月序号'].min()
+    if len(price_hist) > 2:
+        x_with_const = sm.add_constant(month_offset)
+        try:
+            price_model = sm.RLM(price_hist['单只价格'].values, x_with_const).fit()
+            price_slope = price_model.params[1]
+            price_fit = price_model.fittedvalues
+        except (ZeroDivisionError, np.linalg.LinAlgError, ValueError):
+            pass
+    elif len(price_hist) == 2:
+        price_slope, intercept = np.polyfit(month_offset, price_hist['单只价格'].values, 1)
+        price_fit = intercept + price_slope * month_offset
+
+    st.markdown(f"**{latest_row.get('Title', '')}**")
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("累计销量", f"{asin_rows['销量'].sum():,.0f}")
+    m2.metric("活跃月数", f"{asin_rows['month(month)'].nunique()} 个月")
+    m3.metric("最新单只价格", f"{price_hist['单只价格'].iloc[-1]:.2f}" if not price_hist.empty else "-")
+    m4.metric("价格趋势 (每月)", f"{price_slope:+.3f}" if price_slope is not None else "-")
+
+    col_sales, col_price = st.columns(2)
+    with col_sales:
+        fig_drill_sales = px.bar(
+            asin_monthly, x='时间轴', y='销量', text_auto='.2s',
+            title=f"{selected_drill} 月度销量", template="plotly_white"
+        )
+        st.plotly_chart(fig_drill_sales, use_container_width=True)
+    with col_price:
+        fig_drill_price = go.Figure()
+        fig_drill_price.add_trace(go.Scatter(
+            x=price_hist['时间轴'], y=price_hist['单只价格'], name='单只价格', mode='lines+markers',
+            line=dict(color='#1f77b4', width=3),
+            hovertemplate="时间: %{x}<br>单只价格: %{y:.3f}<extra></extra>"
+        ))
+        if price_fit is not None:
+            fig_drill_price.add_trace(go.Scatter(
+                x=price_hist['时间轴'], y=price_fit, name='趋势拟合 (RLM)' if len(price_hist) > 2 else '趋势拟合', mode='lines',
+                line=dict(color='#d65a5a', dash='dash'),
+                hovertemplate="拟合: %{y:.3f}<extra></extra>"
+            ))
+        fig_drill_price.update_layout(
+            title=f"{selected_drill} 单只价格走势与趋势拟合",
+            hovermode="x unified", template="plotly_white",
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+        )
+        st.plotly_chart(fig_drill_price, use_container_width=True)
+
+    # 3. 明细：按 月份 × 笔头类型 × 支数
+    st.dataframe(
+        asin_rows.groupby(['时间轴', '是否8+', '笔头类型', '支数'], observed=True).agg(
+            销量=('销量', 'sum'), 销售额=('销售额', 'sum'), 单只价格=('单只价格', 'mean')
+        ).reset_index(),
+        use_container_width=True, hide_index=True
+    )
+    flagged = int((asin_rows['数据问题'] > 0).sum())
+    if flagged:
+        st.caption(f"⚠️ 该 ASIN 有 {flagged} 行存在数据质量问题，详见顶部「数据质量检查」。")
+else:
+    st.info("在 ASIN 矩阵中点选散点、在 Top-N 榜单中点选 ASIN，或在上方搜索框中选择 ASIN 查看下钻详情。")
+
+
+# --- 8. 静态报告导出 (侧边栏) ---
+st.sidebar.markdown("---")
+st.sidebar.header("📤 静态报告导出")
+export_all_ages = st.sidebar.checkbox("包含全部市场分类 (全部 / 是 / 否)", value=True)
+
+export_ages = ["全部", "是", "否"] if export_all_ages else [selected_age]
+# 报告对应的参数；筛选条件或 Top-N 变化后旧报告已过期，直接清除
+export_params = (tuple(selected_years), tuple(export_ages), top_n)
+if st.session_state.get('report_params') != export_params:
+    st.session_state.pop('report', None)
+
+if st.sidebar.button("生成 HTML / JSON 报告"):
+    with st.sidebar:
+        with st.spinner("正在并行生成报告..."):
+            # 结果与参数一并存入 session_state，点击下载按钮触发重跑后依然可用
+            st.session_state['report'] = build_report(df, selected_years, export_ages, top_n)
+            st.session_state['report_params'] = export_params
+
+if 'report' in st.session_state:
+    report_html, report_json = st.session_state['report']
+    stamp = datetime.now().strftime('%Y%m%d')
+    st.sidebar.caption(f"报告参数：年份 {'、'.join(selected_years)} | 分类 {' / '.join(export_ages)} | Top{top_n}")
+    st.sidebar.download_button("⬇️ 下载 HTML 报告", report_html, file_name=f"酒精笔报告_{stamp}.html", mime="text/html")
+    st.sidebar.download_button("⬇️ 下载图表 JSON", report_json, file_name=f"酒精笔报告_{stamp}.json", mime="application/json")